@@ -0,0 +1,88 @@
+"""Compare embedding backends: cluster agreement with torch and encode throughput.
+
+Usage: python benchmark_embeddings.py [--repeats 5] [--min-ari 0.9]
+
+Exits non-zero when any backend's clustering drifts below --min-ari. Run it
+before setting EMBEDDING_QUANTIZE=1; nothing checks accuracy at runtime.
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.metrics import adjusted_rand_score
+
+from embedding_backend import OnnxEmbedder, TorchEmbedder
+
+# Fixed review set so runs are comparable across machines and model exports
+REVIEWS = [
+    "The pani puri was crisp and the water had the perfect tang.",
+    "Loved the spicy chutney, will definitely come back for more.",
+    "Best vada pav in the area, fresh and hot every time.",
+    "Portions are generous and the flavours are authentic.",
+    "Waited almost forty minutes for a single plate of noodles.",
+    "Service is painfully slow during the evening rush.",
+    "Staff ignored us for a long time before taking the order.",
+    "Queue was huge and the order took ages to arrive.",
+    "The counter was dirty and there were flies around the food.",
+    "Vendor handled money and food with the same hands, not hygienic.",
+    "Plates were not washed properly and smelled bad.",
+    "Saw stale oil being reused, the place needs a proper clean.",
+    "Prices are a bit high for street food but the taste makes up for it.",
+    "Too expensive compared to the other stalls nearby.",
+    "Great value, a full meal for under a hundred rupees.",
+    "Cheap and filling, perfect for students on a budget.",
+]
+
+
+def cluster(embeddings, n_clusters=4):
+    return KMeans(n_clusters=n_clusters, random_state=42).fit_predict(embeddings)
+
+
+def throughput(embedder, sentences, repeats):
+    embedder.encode(sentences)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        embedder.encode(sentences)
+    elapsed = time.perf_counter() - start
+    return len(sentences) * repeats / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--min-ari", type=float, default=0.9)
+    args = parser.parse_args()
+
+    sentences = REVIEWS * 16
+    backends = {
+        "torch": TorchEmbedder(),
+        "onnx-fp32": OnnxEmbedder(quantize=False),
+        "onnx-int8": OnnxEmbedder(quantize=True),
+    }
+
+    reference = backends["torch"].encode(REVIEWS)
+    reference_labels = cluster(reference)
+
+    failed = []
+    print(f"{'backend':<10} {'sent/s':>10} {'ARI':>6} {'cosine':>7}")
+    for name, embedder in backends.items():
+        embeddings = embedder.encode(REVIEWS)
+        ari = adjusted_rand_score(reference_labels, cluster(embeddings))
+        cosine = np.mean(
+            np.sum(reference * embeddings, axis=1)
+            / (np.linalg.norm(reference, axis=1) * np.linalg.norm(embeddings, axis=1))
+        )
+        rate = throughput(embedder, sentences, args.repeats)
+        print(f"{name:<10} {rate:>10.1f} {ari:>6.3f} {cosine:>7.4f}")
+        if ari < args.min_ari:
+            failed.append(name)
+
+    if failed:
+        print(f"ARI below {args.min_ari} for: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import json
+import os
+import re
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from keybert.backend import BaseEmbedder
+from sentence_transformers import SentenceTransformer
+
+load_dotenv()
+
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+# Backend selection: "torch" (stock SentenceTransformer) or "onnx" (ONNX Runtime)
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+# int8 is opt-in: run benchmark_embeddings.py and check its ARI before enabling
+EMBEDDING_QUANTIZE = os.getenv("EMBEDDING_QUANTIZE", "0") == "1"
+# Unset leaves torch / ONNX Runtime on their own defaults (physical cores)
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS")) if os.getenv("EMBEDDING_THREADS") else None
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+ONNX_CACHE_DIR = Path(os.getenv("ONNX_CACHE_DIR", "./onnx_models"))
+
+
+def _write_atomic(path: Path, write):
+    """Call write(tmp_path) and move the result into place only once it completed"""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class TorchEmbedder:
+    """Stock PyTorch SentenceTransformer in fp32"""
+
+    def __init__(self, model_name: str = MODEL_NAME, threads: Optional[int] = EMBEDDING_THREADS):
+        if threads:
+            import torch
+
+            torch.set_num_threads(threads)
+        self.model = SentenceTransformer(model_name, device="cpu")
+
+    def encode(self, sentences: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        return self.model.encode(sentences, batch_size=batch_size)
+
+
+class OnnxEmbedder:
+    """ONNX Runtime export of the SentenceTransformer with optional int8 quantization"""
+
+    def __init__(
+        self,
+        model_name: str = MODEL_NAME,
+        quantize: bool = EMBEDDING_QUANTIZE,
+        threads: Optional[int] = EMBEDDING_THREADS,
+        cache_dir: Path = ONNX_CACHE_DIR,
+    ):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_path, meta = self._export(Path(cache_dir), model_name, quantize)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.max_seq_length = meta["max_seq_length"]
+        self.hidden_size = meta["hidden_size"]
+        self.normalize = meta["normalize"]
+
+        options = ort.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @staticmethod
+    def _export(cache_dir: Path, model_name: str, quantize: bool):
+        """Export the transformer to ONNX once and reuse the cached files afterwards.
+
+        Returns the model path and the pooling metadata saved next to it, so the
+        SentenceTransformer is only loaded for the initial export. Every file is
+        written to a temp name and renamed, and the metadata goes last, so a
+        crashed or concurrent export never leaves a partial model to be loaded.
+        """
+        import torch
+
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        stem = re.sub(r"[^A-Za-z0-9._-]", "__", model_name)
+        fp32_path = cache_dir / f"{stem}.onnx"
+        int8_path = cache_dir / f"{stem}.int8.onnx"
+        meta_path = cache_dir / f"{stem}.json"
+
+        if not fp32_path.exists() or not meta_path.exists():
+            st_model = SentenceTransformer(model_name, device="cpu")
+            transformer = st_model[0].auto_model.eval()
+            dummy = st_model.tokenizer(["export"], return_tensors="pt")
+            dynamic_axes = {"last_hidden_state": {0: "batch", 1: "sequence"}}
+            for name in ("input_ids", "attention_mask", "token_type_ids"):
+                dynamic_axes[name] = {0: "batch", 1: "sequence"}
+            with torch.no_grad():
+                _write_atomic(fp32_path, lambda tmp: torch.onnx.export(
+                    transformer,
+                    (dummy["input_ids"], dummy["attention_mask"], dummy["token_type_ids"]),
+                    tmp,
+                    input_names=["input_ids", "attention_mask", "token_type_ids"],
+                    output_names=["last_hidden_state"],
+                    dynamic_axes=dynamic_axes,
+                    opset_version=14,
+                ))
+            meta = {
+                "max_seq_length": st_model.max_seq_length,
+                "hidden_size": transformer.config.hidden_size,
+                # all-MiniLM-L6-v2 ends with a Normalize module; mirror it so outputs match
+                "normalize": any(type(m).__name__ == "Normalize" for m in st_model),
+            }
+            _write_atomic(meta_path, lambda tmp: Path(tmp).write_text(json.dumps(meta)))
+            del st_model, transformer
+
+        meta = json.loads(meta_path.read_text())
+        if not quantize:
+            return fp32_path, meta
+
+        if not int8_path.exists():
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            _write_atomic(int8_path, lambda tmp: quantize_dynamic(
+                str(fp32_path), tmp, weight_type=QuantType.QInt8
+            ))
+        return int8_path, meta
+
+    def encode(self, sentences: List[str], batch_size: int = EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        if not sentences:
+            return np.empty((0, self.hidden_size), dtype=np.float32)
+
+        # Sort by length so each batch is padded only to its own longest input
+        order = np.argsort([-len(s) for s in sentences], kind="stable")
+        embeddings = [None] * len(sentences)
+
+        for start in range(0, len(sentences), batch_size):
+            batch_idx = order[start:start + batch_size]
+            batch = [sentences[i] for i in batch_idx]
+            tokens = self.tokenizer(
+                batch,
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors="np",
+            )
+            feed = {
+                name: tokens[name].astype(np.int64)
+                for name in self.input_names
+                if name in tokens
+            }
+            hidden = self.session.run(None, feed)[0]
+
+            # Mean pooling over non-padding tokens, as in SentenceTransformer
+            mask = tokens["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+            for i, vec in zip(batch_idx, pooled):
+                embeddings[i] = vec
+
+        return np.stack(embeddings).astype(np.float32)
+
+
+class KeyBERTEmbedder(BaseEmbedder):
+    """Lets KeyBERT reuse the selected embedder instead of loading its own model"""
+
+    def __init__(self, embedder):
+        super().__init__()
+        self.embedder = embedder
+
+    def embed(self, documents: List[str], verbose: bool = False) -> np.ndarray:
+        return self.embedder.encode(list(documents))
+
+
+def load_embedder(backend: str = EMBEDDING_BACKEND):
+    """Return an embedder exposing encode(sentences) -> np.ndarray"""
+    if backend == "torch":
+        return TorchEmbedder()
+    if backend == "onnx":
+        return OnnxEmbedder()
+    raise ValueError(f"Unknown embedding backend: {backend}")
@@ -4,6 +4,7 @@ from cleanliness import (
     generate_cleanliness_report,
 )  # Import the generate report function
 from whatsapp_notifier import WhatsAppNotifier  # Import the WhatsApp notifier class
+from whatsapp_outbox import WhatsAppDispatcher
 import os
 import requests
 import json
@@ -16,6 +17,7 @@ from nltk_review import (
     analyze_reviews as analyze_reviews_nltk,
 )  # Import the review analysis function
 from groq import Groq
+from single_flight import SingleFlight, SingleFlightError, SingleFlightTimeout
 import torch
 
 app = Flask(__name__)
@@ -25,6 +27,47 @@ CORS(app)
 NODE_API_URL = os.getenv("NODE_API_URL")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
+# Request coalescing: waiters give up after these many seconds (leader keeps running)
+ANALYZE_FLIGHT_TIMEOUT = float(os.getenv("ANALYZE_FLIGHT_TIMEOUT", "60"))
+ASSISTANT_FLIGHT_TIMEOUT = float(os.getenv("ASSISTANT_FLIGHT_TIMEOUT", "30"))
+# Upstream calls made by the shared computation; kept well under the flight
+# timeouts so a hung backend fails the leader instead of stalling every waiter
+ANALYZE_FETCH_TIMEOUT = float(os.getenv("ANALYZE_FETCH_TIMEOUT", "15"))
+ASSISTANT_FETCH_TIMEOUT = float(os.getenv("ASSISTANT_FETCH_TIMEOUT", "5"))
+ASSISTANT_LLM_TIMEOUT = float(os.getenv("ASSISTANT_LLM_TIMEOUT", "15"))
+flight = SingleFlight()
+
+
+# Coalescing keys: requests mapping to the same key share one computation.
+# Both routes read nothing but stall_id, so it fully determines the response.
+def analyze_flight_key(stall_id):
+    return f"analyze:{stall_id}"
+
+
+def assistant_flight_key(data):
+    return f"foodAssistant:{data['stall_id']}"
+
+
+# Reports are queued in a SQLite outbox and sent by a rate-limited dispatcher.
+# "dev" (default) runs it in-process only under `python main.py`; WSGI
+# workers should run `python whatsapp_outbox.py` once instead so a single
+# token bucket applies. "inline" forces it on for single-worker servers,
+# "off" disables it.
+WHATSAPP_DISPATCHER = os.getenv("WHATSAPP_DISPATCHER", "dev").lower()
+notifier = WhatsAppNotifier()
+whatsapp_dispatcher = None
+# Under app.run(debug=True) the reloader parent only watches files; the
+# serving child has WERKZEUG_RUN_MAIN set, so only it starts the dispatcher
+if __name__ == "__main__":
+    start_dispatcher = WHATSAPP_DISPATCHER in ("dev", "inline") and (
+        os.environ.get("WERKZEUG_RUN_MAIN") == "true"
+    )
+else:
+    start_dispatcher = WHATSAPP_DISPATCHER == "inline"
+if start_dispatcher:
+    whatsapp_dispatcher = WhatsAppDispatcher(notifier)
+    whatsapp_dispatcher.start()
+
 
 @app.route("/generate_report", methods=["GET"])
 def generate_report():
@@ -59,23 +102,21 @@ def generate_report():
                 400,
             )
 
-        # Pass the report to WhatsAppNotifier
-        notifier = WhatsAppNotifier()
-        success = notifier.notify_vendor("+919326445840", report_data)
-
-        if not success:
+        # Queue the report for the WhatsApp dispatcher
+        notification = notifier.notify_vendor("+919326445840", report_data)
+        if not notification:
             return (
                 jsonify(
                     {
                         "status": "error",
-                        "message": "Failed to send WhatsApp notification",
+                        "message": "Failed to queue WhatsApp notification",
                     }
                 ),
                 500,
             )
 
-        # Return the final report in JSON format
-        return jsonify(report_data["report"]), 200
+        # Return the final report in JSON format, with "queued" or "duplicate"
+        return jsonify({**report_data["report"], "notification": notification}), 200
 
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -86,64 +127,79 @@ def analyze_reviews(stall_id):
     try:
         print(f"Starting analysis for stall ID: {stall_id}")
 
-        # Fetch reviews from Node.js backend
-        print(f"Fetching reviews from Node.js backend for stall ID: {stall_id}")
-        res = requests.get(f"{NODE_API_URL}/{stall_id}")
-        res.raise_for_status()
+        # Concurrent requests for the same stall share one fetch + analysis
+        body, status = flight.do(
+            analyze_flight_key(stall_id),
+            lambda: compute_review_analysis(stall_id),
+            timeout=ANALYZE_FLIGHT_TIMEOUT,
+        )
+        return jsonify(body), status
+
+    except SingleFlightTimeout as e:
+        print(f"Timed out waiting for analysis of stall ID {stall_id}: {str(e)}")
+        return jsonify({"error": f"Analysis timed out: {str(e)}"}), 504
+    except SingleFlightError as e:
+        # A concurrent request ran the analysis and it failed; report its error
+        if isinstance(e.original, requests.exceptions.RequestException):
+            return jsonify({"error": f"Error fetching data: {str(e.original)}"}), 500
+        print(f"Shared analysis failed for stall ID {stall_id}: {str(e)}")
+        return jsonify({"error": f"Unexpected error: {str(e.original or e)}"}), 500
+    except requests.exceptions.RequestException as e:
+        print(
+            f"Error fetching data from Node.js backend for stall ID {stall_id}: {str(e)}"
+        )
+        return jsonify({"error": f"Error fetching data: {str(e)}"}), 500
+    except Exception as e:
+        print(f"Unexpected error during analysis for stall ID {stall_id}: {str(e)}")
+        return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
 
-        # Parse JSON response
-        try:
-            print(f"Parsing JSON response from Node.js backend")
-            data = res.json()
-        except ValueError:
-            print(
-                f"Invalid JSON received from Node.js backend for stall ID: {stall_id}"
-            )
-            return (
-                jsonify({"error": "Invalid JSON received from the Node.js backend"}),
-                400,
-            )
 
-        if not data:
-            print(f"No reviews found for stall ID: {stall_id}")
-            return jsonify({"error": "No reviews found."}), 404
+def compute_review_analysis(stall_id):
+    """Fetch and analyze reviews for a stall, returning (body, status)"""
+    # Fetch reviews from Node.js backend
+    print(f"Fetching reviews from Node.js backend for stall ID: {stall_id}")
+    res = requests.get(f"{NODE_API_URL}/{stall_id}", timeout=ANALYZE_FETCH_TIMEOUT)
+    res.raise_for_status()
 
-        # Extract ratings and review text
-        ratings = [r["rating"] for r in data if "rating" in r]
-        reviews = [r["review_text"] for r in data if "review_text" in r]
+    # Parse JSON response
+    try:
+        print(f"Parsing JSON response from Node.js backend")
+        data = res.json()
+    except ValueError:
+        print(f"Invalid JSON received from Node.js backend for stall ID: {stall_id}")
+        return {"error": "Invalid JSON received from the Node.js backend"}, 400
 
-        print(
-            f"Extracted {len(ratings)} ratings and {len(reviews)} reviews for stall ID: {stall_id}"
-        )
+    if not data:
+        print(f"No reviews found for stall ID: {stall_id}")
+        return {"error": "No reviews found."}, 404
 
-        avg_rating = round(sum(ratings) / len(ratings), 2) if ratings else 0
-        print(f"Average rating for stall ID {stall_id}: {avg_rating}")
+    # Extract ratings and review text
+    ratings = [r["rating"] for r in data if "rating" in r]
+    reviews = [r["review_text"] for r in data if "review_text" in r]
 
-        # Handle keyword extraction and analysis
-        print(f"Starting review analysis for stall ID {stall_id}")
+    print(
+        f"Extracted {len(ratings)} ratings and {len(reviews)} reviews for stall ID: {stall_id}"
+    )
 
-        # Call the analysis function
-        summary_result = analyze_reviews_nltk(reviews)
+    avg_rating = round(sum(ratings) / len(ratings), 2) if ratings else 0
+    print(f"Average rating for stall ID {stall_id}: {avg_rating}")
 
-        # Ensure we have a proper dictionary response
-        if isinstance(summary_result, str):
-            try:
-                summary_result = json.loads(summary_result)
-            except json.JSONDecodeError:
-                summary_result = {"error": "Invalid analysis result format"}
-        elif not isinstance(summary_result, dict):
-            summary_result = {"error": "Unexpected analysis result type"}
+    # Handle keyword extraction and analysis
+    print(f"Starting review analysis for stall ID {stall_id}")
 
-        return jsonify({"average_rating": avg_rating, "review_summary": summary_result})
+    # Call the analysis function
+    summary_result = analyze_reviews_nltk(reviews)
 
-    except requests.exceptions.RequestException as e:
-        print(
-            f"Error fetching data from Node.js backend for stall ID {stall_id}: {str(e)}"
-        )
-        return jsonify({"error": f"Error fetching data: {str(e)}"}), 500
-    except Exception as e:
-        print(f"Unexpected error during analysis for stall ID {stall_id}: {str(e)}")
-        return jsonify({"error": f"Unexpected error: {str(e)}"}), 500
+    # Ensure we have a proper dictionary response
+    if isinstance(summary_result, str):
+        try:
+            summary_result = json.loads(summary_result)
+        except json.JSONDecodeError:
+            summary_result = {"error": "Invalid analysis result format"}
+    elif not isinstance(summary_result, dict):
+        summary_result = {"error": "Unexpected analysis result type"}
+
+    return {"average_rating": avg_rating, "review_summary": summary_result}, 200
 
 
 # Add this import at the top of your file
@@ -177,45 +233,65 @@ def food_assistant():
 
         stall_id = data["stall_id"]
 
-        # Fetch stall data
-        stall_resp = requests.post(
-            "https://khalo-r5v5.onrender.com/customer/getSingleStall",
-            json={"stall_id": stall_id},
-            headers={"Content-Type": "application/json"},
+        # Concurrent requests for the same stall share one fetch + Groq call
+        body, status = flight.do(
+            assistant_flight_key(data),
+            lambda: compute_food_assistant(stall_id),
+            timeout=ASSISTANT_FLIGHT_TIMEOUT,
         )
-        if stall_resp.status_code != 200:
-            return jsonify({"error": f"Stall API failed: {stall_resp.text}"}), 400
+        return jsonify(body), status
 
-        try:
-            stall_data = stall_resp.json()
-            # Handle case where response is a list
-            if isinstance(stall_data, list):
-                if len(stall_data) == 0:
-                    return jsonify({"error": "No stall data found"}), 400
-                stall_data = stall_data[0]
-            elif not isinstance(stall_data, dict):
-                return jsonify({"error": "Invalid stall data format"}), 400
-        except ValueError:
-            return jsonify({"error": "Invalid JSON from Stall API"}), 400
-
-        # Fetch menu data
-        menu_resp = requests.post(
-            "https://khalo-r5v5.onrender.com/vendor/getMenuItems",
-            json={"stall_id": stall_id},
-            headers={"Content-Type": "application/json"},
-        )
-        if menu_resp.status_code != 200:
-            return jsonify({"error": f"Menu API failed: {menu_resp.text}"}), 400
+    except SingleFlightTimeout as e:
+        return jsonify({"error": f"Assistant timed out: {str(e)}"}), 504
+    except SingleFlightError as e:
+        return jsonify({"error": str(e.original or e)}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        try:
-            menu_items = menu_resp.json()
-            if not isinstance(menu_items, list):
-                menu_items = []  # Default to empty list if unexpected format
-        except ValueError:
-            return jsonify({"error": "Invalid JSON from Menu API"}), 400
-
-        # Generate prompt
-        prompt = f"""
+
+def compute_food_assistant(stall_id):
+    """Fetch stall and menu data and ask the LLM, returning (body, status)"""
+    # Fetch stall data
+    stall_resp = requests.post(
+        "https://khalo-r5v5.onrender.com/customer/getSingleStall",
+        json={"stall_id": stall_id},
+        headers={"Content-Type": "application/json"},
+        timeout=ASSISTANT_FETCH_TIMEOUT,
+    )
+    if stall_resp.status_code != 200:
+        return {"error": f"Stall API failed: {stall_resp.text}"}, 400
+
+    try:
+        stall_data = stall_resp.json()
+        # Handle case where response is a list
+        if isinstance(stall_data, list):
+            if len(stall_data) == 0:
+                return {"error": "No stall data found"}, 400
+            stall_data = stall_data[0]
+        elif not isinstance(stall_data, dict):
+            return {"error": "Invalid stall data format"}, 400
+    except ValueError:
+        return {"error": "Invalid JSON from Stall API"}, 400
+
+    # Fetch menu data
+    menu_resp = requests.post(
+        "https://khalo-r5v5.onrender.com/vendor/getMenuItems",
+        json={"stall_id": stall_id},
+        headers={"Content-Type": "application/json"},
+        timeout=ASSISTANT_FETCH_TIMEOUT,
+    )
+    if menu_resp.status_code != 200:
+        return {"error": f"Menu API failed: {menu_resp.text}"}, 400
+
+    try:
+        menu_items = menu_resp.json()
+        if not isinstance(menu_items, list):
+            menu_items = []  # Default to empty list if unexpected format
+    except ValueError:
+        return {"error": "Invalid JSON from Menu API"}, 400
+
+    # Generate prompt
+    prompt = f"""
 You are an expert food assistant at a food court. Use this information:
 
 === STALL DETAILS ===
@@ -230,25 +306,31 @@ Description: {stall_data.get('description', 'No description available')}
 Please provide helpful recommendations or answer questions.
 """
 
-        # Get LLM response
-        response = groq_client.chat.completions.create(
-            model="Llama-3.1-8b-Instant",
-            messages=[
-                {"role": "system", "content": "You are a friendly food assistant."},
-                {"role": "user", "content": prompt},
-            ],
-        )
+    # Get LLM response
+    response = groq_client.chat.completions.create(
+        model="Llama-3.1-8b-Instant",
+        messages=[
+            {"role": "system", "content": "You are a friendly food assistant."},
+            {"role": "user", "content": prompt},
+        ],
+        timeout=ASSISTANT_LLM_TIMEOUT,
+    )
 
-        return jsonify(
-            {
-                "assistant_response": response.choices[0].message.content,
-                "stall_name": stall_data.get("name"),
-                "cuisine": stall_data.get("cuisine_type"),
-            }
-        )
+    return {
+        "assistant_response": response.choices[0].message.content,
+        "stall_name": stall_data.get("name"),
+        "cuisine": stall_data.get("cuisine_type"),
+    }, 200
 
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+@app.route("/whatsapp/outbox/stats", methods=["GET"])
+def whatsapp_outbox_stats():
+    return jsonify(notifier.outbox.stats()), 200
+
+
+@app.route("/singleflight/stats", methods=["GET"])
+def single_flight_stats():
+    return jsonify(flight.stats()), 200
 
 
 def format_menu_items(menu_data):
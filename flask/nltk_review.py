@@ -2,11 +2,11 @@ import os
 import numpy as np
 from dotenv import load_dotenv
 from sklearn.cluster import KMeans
-from sentence_transformers import SentenceTransformer
 from keybert import KeyBERT
 from groq import Groq
 import warnings
 import json
+from embedding_backend import KeyBERTEmbedder, load_embedder
 
 # Suppress warnings
 os.environ['TF_ENABLE_ONEDNN_OPTS'] = '0'
@@ -19,8 +19,8 @@ load_dotenv()
 # Initialize clients with error handling
 try:
     client = Groq(api_key=os.getenv("GROQ_API_KEY"))
-    model = SentenceTransformer('all-MiniLM-L6-v2')
-    kw_model = KeyBERT()
+    model = load_embedder()  # EMBEDDING_BACKEND=torch|onnx
+    kw_model = KeyBERT(model=KeyBERTEmbedder(model))
 except Exception as e:
     raise RuntimeError(f"Initialization failed: {str(e)}")
 
@@ -0,0 +1,92 @@
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when a waiter gives up on an in-flight call"""
+
+
+class SingleFlightError(Exception):
+    """Raised in a waiter when the shared call failed; the cause is the original error"""
+
+    def __init__(self, message: str, original: Optional[Exception] = None):
+        super().__init__(message)
+        self.original = original
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.completed = False
+        self.result = None
+        self.error: Optional[Exception] = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+
+    The first caller for a key runs the function; callers arriving while it is
+    still running wait for it and receive the same result. If it fails, the
+    first caller gets the original exception and each waiter gets its own
+    SingleFlightError chained to it.
+    """
+
+    def __init__(self, timeout: Optional[float] = None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self._stats = {
+            "calls": 0,
+            "executions": 0,
+            "coalesced": 0,
+            "errors": 0,
+            "timeouts": 0,
+        }
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Any:
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            if call is None:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executions"] += 1
+                leader = True
+            else:
+                self._stats["coalesced"] += 1
+                leader = False
+
+        if leader:
+            try:
+                call.result = fn()
+                call.completed = True
+                return call.result
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    self._stats["errors"] += 1
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+
+        wait = self.timeout if timeout is None else timeout
+        if not call.done.wait(wait):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise SingleFlightTimeout(f"Timed out after {wait}s waiting for {key!r}")
+
+        if call.error is not None:
+            raise SingleFlightError(
+                f"Shared call for {key!r} failed: {call.error}", call.error
+            ) from call.error
+        if not call.completed:
+            raise SingleFlightError(f"Shared call for {key!r} was interrupted")
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
@@ -1,12 +1,15 @@
 import json
-from typing import Dict, List
+from typing import Dict, List, Optional
 from pathlib import Path
 from twilio.rest import Client
 import googleapiclient.discovery
 
+from whatsapp_outbox import WhatsAppOutbox
+
 
 class WhatsAppNotifier:
-    def __init__(self):
+    def __init__(self, outbox: Optional[WhatsAppOutbox] = None):
+        self.outbox = outbox or WhatsAppOutbox()
         self.config = {
             "twilio": {
                 "account_sid": "AC368c57df4d6428dfbc9ca00992288e56",
@@ -45,13 +48,8 @@ class WhatsAppNotifier:
             video_links[issue] = link
         return video_links
 
-    def send_whatsapp_message(self, vendor_number: str, report: Dict, video_links: Dict[str, str]) -> str:
-        """Send formatted WhatsApp message with improvement resources"""
-        client = Client(
-            self.config["twilio"]["account_sid"],
-            self.config["twilio"]["auth_token"]
-        )
-
+    def build_message(self, report: Dict, video_links: Dict[str, str]) -> str:
+        """Format the cleanliness report and tutorial links as a WhatsApp message"""
         message = (
             "🔍 *Cleanliness Improvement Report* 🔍\n\n"
             f"🏆 *Rating:* {report.get('cleanliness_rating', 'N/A')}/5\n\n"
@@ -65,15 +63,46 @@ class WhatsAppNotifier:
         for rec in report.get("recommendations", []):
             message += f"- {rec}\n"
 
+        return message
+
+    def send_message(self, vendor_number: str, body: str) -> str:
+        """Send a raw WhatsApp message body and return the Twilio message SID"""
+        client = Client(
+            self.config["twilio"]["account_sid"],
+            self.config["twilio"]["auth_token"]
+        )
+
         response = client.messages.create(
-            body=message,
+            body=body,
             from_=self.config["twilio"]["whatsapp_number"],
             to=f"whatsapp:{vendor_number}"
         )
 
         return response.sid
 
-    def notify_vendor(self, vendor_number: str, report_data: Dict):
+    def send_whatsapp_message(self, vendor_number: str, report: Dict, video_links: Dict[str, str]) -> str:
+        """Send formatted WhatsApp message with improvement resources"""
+        return self.send_message(vendor_number, self.build_message(report, video_links))
+
+    def deliver_reports(self, vendor_number: str, reports: List[Dict]) -> str:
+        """Send one message covering all pending reports for a vendor.
+
+        Reports are ordered oldest first; the newest one supersedes the rest,
+        so only it is rendered and the older ones are mentioned by count.
+        """
+        report = reports[-1]
+        video_links = self.find_youtube_videos(report.get("issues_found", []))
+        message = self.build_message(report, video_links)
+        if len(reports) > 1:
+            message += f"\n_(Replaces {len(reports) - 1} earlier report(s) not yet delivered)_\n"
+        return self.send_message(vendor_number, message)
+
+    def notify_vendor(self, vendor_number: str, report_data: Dict, idempotency_key: Optional[str] = None):
+        """Queue the report for delivery; the outbox dispatcher sends it.
+
+        Returns "queued", "duplicate" when the same report is still waiting to
+        be sent, or None when nothing was queued.
+        """
         try:
             if report_data.get("status") != "success":
                 print("Report status is not success")
@@ -85,16 +114,13 @@ class WhatsAppNotifier:
                 print("No issues found in the report")
                 return
 
-            print(f"Found {len(issues)} issues - searching for tutorials...")
-            video_links = self.find_youtube_videos(issues)
+            if not self.outbox.enqueue(vendor_number, report, idempotency_key):
+                print(f"⚠️ Identical report for {vendor_number} is still pending, dropped duplicate")
+                return "duplicate"
 
-            print(f"Sending WhatsApp to {vendor_number}...")
-            message_id = self.send_whatsapp_message(vendor_number, report, video_links)
-
-            print(f"✅ Notification sent successfully! Message ID: {message_id}")
-            return True
+            print(f"📥 Queued report with {len(issues)} issues for {vendor_number}")
+            return "queued"
 
         except Exception as e:
-            print(f"❌ Error sending notification: {str(e)}")
-            return False
-
+            print(f"❌ Error queueing notification: {str(e)}")
+            return None
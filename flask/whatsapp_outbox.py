@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+OUTBOX_DB_PATH = os.getenv("WHATSAPP_OUTBOX_DB", "./whatsapp_outbox.db")
+# Twilio's default WhatsApp throughput is roughly one message per second per sender
+WHATSAPP_RATE_PER_SEC = float(os.getenv("WHATSAPP_RATE_PER_SEC", "1"))
+WHATSAPP_BURST = int(os.getenv("WHATSAPP_BURST", "5"))
+WHATSAPP_MAX_ATTEMPTS = int(os.getenv("WHATSAPP_MAX_ATTEMPTS", "5"))
+WHATSAPP_BACKOFF_BASE = float(os.getenv("WHATSAPP_BACKOFF_BASE", "2"))
+WHATSAPP_BACKOFF_MAX = float(os.getenv("WHATSAPP_BACKOFF_MAX", "300"))
+# Rows left in 'sending' longer than this are assumed abandoned and reclaimed
+WHATSAPP_LEASE_SECONDS = float(os.getenv("WHATSAPP_LEASE_SECONDS", "300"))
+
+if WHATSAPP_RATE_PER_SEC <= 0:
+    raise ValueError("WHATSAPP_RATE_PER_SEC must be greater than 0")
+
+
+class WhatsAppOutbox:
+    """Durable queue of vendor reports waiting to be sent, stored in SQLite"""
+
+    def __init__(self, db_path: str = OUTBOX_DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    idempotency_key TEXT NOT NULL,
+                    vendor_number TEXT NOT NULL,
+                    report TEXT NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL,
+                    claimed_at REAL,
+                    created_at REAL NOT NULL,
+                    sent_at REAL,
+                    message_sid TEXT,
+                    last_error TEXT
+                )
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)"
+            )
+            # Keys only dedupe against undelivered rows, so an identical report
+            # generated after the previous one went out is queued again
+            conn.execute(
+                """
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_active_key
+                ON outbox (idempotency_key) WHERE status IN ('pending', 'sending')
+                """
+            )
+
+    def _connect(self) -> "_Transaction":
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return _Transaction(conn)
+
+    @staticmethod
+    def make_idempotency_key(vendor_number: str, report: Dict) -> str:
+        payload = json.dumps({"vendor": vendor_number, "report": report}, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def enqueue(self, vendor_number: str, report: Dict, idempotency_key: Optional[str] = None) -> bool:
+        """Add a report to the outbox; returns False if the key is still undelivered"""
+        key = idempotency_key or self.make_idempotency_key(vendor_number, report)
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                """
+                INSERT OR IGNORE INTO outbox
+                    (idempotency_key, vendor_number, report, next_attempt_at, created_at)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (key, vendor_number, json.dumps(report), now, now),
+            )
+            return cursor.rowcount == 1
+
+    def due_vendors(self, limit: int, lease: float = WHATSAPP_LEASE_SECONDS) -> List[str]:
+        """Vendors with a report due now (or an expired lease), oldest first"""
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT vendor_number FROM outbox
+                WHERE (status = 'pending' AND next_attempt_at <= ?)
+                   OR (status = 'sending' AND claimed_at <= ?)
+                GROUP BY vendor_number
+                ORDER BY MIN(created_at)
+                LIMIT ?
+                """,
+                (now, now - lease, limit),
+            ).fetchall()
+        return [row["vendor_number"] for row in rows]
+
+    def claim_vendor(self, vendor_number: str, lease: float = WHATSAPP_LEASE_SECONDS) -> List[sqlite3.Row]:
+        """Lease every undelivered report for a vendor, oldest first.
+
+        Claims only if one of the vendor's rows is due, and takes all of its
+        pending rows regardless of their own backoff so an older report never
+        goes out after a newer one. Returns [] if another dispatcher holds a
+        live lease on the vendor or nothing is due any more. Rows stuck in
+        'sending' past the lease (e.g. their dispatcher crashed) are reclaimed.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            rows = conn.execute(
+                """
+                SELECT * FROM outbox
+                WHERE vendor_number = ? AND status IN ('pending', 'sending')
+                ORDER BY created_at
+                """,
+                (vendor_number,),
+            ).fetchall()
+            if any(r["status"] == "sending" and r["claimed_at"] > now - lease for r in rows):
+                return []
+            if not any(r["status"] == "sending" or r["next_attempt_at"] <= now for r in rows):
+                return []
+            conn.executemany(
+                "UPDATE outbox SET status = 'sending', claimed_at = ? WHERE id = ?",
+                [(now, row["id"]) for row in rows],
+            )
+        return rows
+
+    def mark_sent(self, ids: List[int], message_sid: str):
+        with self._connect() as conn:
+            conn.executemany(
+                """
+                UPDATE outbox SET status = 'sent', sent_at = ?, message_sid = ?, last_error = NULL
+                WHERE id = ?
+                """,
+                [(time.time(), message_sid, i) for i in ids],
+            )
+
+    def mark_failed(self, ids: List[int], error: str, max_attempts: int, backoff_base: float, backoff_max: float):
+        """Schedule a retry with exponential backoff, or give up after max_attempts.
+
+        The batch shares one attempt count (the highest among its rows), so a
+        coalesced group is retried and given up on together.
+        """
+        now = time.time()
+        placeholders = ",".join("?" for _ in ids)
+        with self._connect() as conn:
+            attempts = conn.execute(
+                f"SELECT MAX(attempts) AS n FROM outbox WHERE id IN ({placeholders})", ids
+            ).fetchone()["n"] + 1
+            status = "failed" if attempts >= max_attempts else "pending"
+            delay = min(backoff_max, backoff_base ** attempts)
+            conn.execute(
+                f"""
+                UPDATE outbox SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?
+                WHERE id IN ({placeholders})
+                """,
+                (status, attempts, now + delay, error, *ids),
+            )
+
+    def stats(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT status, COUNT(*) AS n FROM outbox GROUP BY status"
+            ).fetchall()
+        return {row["status"]: row["n"] for row in rows}
+
+
+class _Transaction:
+    """Context manager running the block in one IMMEDIATE transaction"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.conn.close()
+
+
+class TokenBucket:
+    """Thread-safe token bucket limiting sends to `rate` per second"""
+
+    def __init__(self, rate: float = WHATSAPP_RATE_PER_SEC, capacity: int = WHATSAPP_BURST):
+        if rate <= 0:
+            raise ValueError("Token bucket rate must be greater than 0")
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, stop: Optional[threading.Event] = None) -> bool:
+        """Block until a token is available; returns False if stopped first"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return True
+                wait = (1 - self.tokens) / self.rate
+            if stop is not None:
+                if stop.wait(wait):
+                    return False
+            else:
+                time.sleep(wait)
+
+
+class WhatsAppDispatcher(threading.Thread):
+    """Background thread draining the outbox through the notifier"""
+
+    def __init__(
+        self,
+        notifier,
+        outbox: Optional[WhatsAppOutbox] = None,
+        bucket: Optional[TokenBucket] = None,
+        poll_interval: float = 1.0,
+        max_attempts: int = WHATSAPP_MAX_ATTEMPTS,
+        backoff_base: float = WHATSAPP_BACKOFF_BASE,
+        backoff_max: float = WHATSAPP_BACKOFF_MAX,
+    ):
+        super().__init__(name="whatsapp-dispatcher", daemon=True)
+        self.notifier = notifier
+        self.outbox = outbox or notifier.outbox
+        self.bucket = bucket or TokenBucket()
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            try:
+                sent = self.drain_once()
+            except Exception as e:
+                print(f"❌ WhatsApp dispatcher error: {str(e)}")
+                sent = 0
+            if not sent:
+                self._stop_event.wait(self.poll_interval)
+
+    def drain_once(self) -> int:
+        """Send one coalesced message per vendor with due reports.
+
+        At most one bucket's worth of vendors is picked per pass, and each
+        vendor is leased only after its token is granted, so a lease never
+        runs out while the rows wait on the rate limit.
+        """
+        sent = 0
+        for vendor_number in self.outbox.due_vendors(limit=self.bucket.capacity):
+            if not self.bucket.acquire(self._stop_event):
+                break
+            rows = self.outbox.claim_vendor(vendor_number)
+            if not rows:
+                continue
+            ids = [row["id"] for row in rows]
+            try:
+                reports = [json.loads(row["report"]) for row in rows]
+                message_id = self.notifier.deliver_reports(vendor_number, reports)
+                self.outbox.mark_sent(ids, message_id)
+                sent += 1
+                print(f"✅ Sent {len(ids)} report(s) to {vendor_number}. Message ID: {message_id}")
+            except Exception as e:
+                self.outbox.mark_failed(
+                    ids, str(e), self.max_attempts, self.backoff_base, self.backoff_max
+                )
+                print(f"❌ Error sending to {vendor_number}, will retry: {str(e)}")
+        return sent
+
+
+if __name__ == "__main__":
+    # Standalone dispatcher for WSGI deployments (e.g. several gunicorn
+    # workers); run exactly one so a single token bucket applies
+    from whatsapp_notifier import WhatsAppNotifier
+
+    dispatcher = WhatsAppDispatcher(WhatsAppNotifier())
+    dispatcher.start()
+    try:
+        dispatcher.join()
+    except KeyboardInterrupt:
+        dispatcher.stop()